@@ -26,7 +26,17 @@ This file is part of APTDacManager.
 
 import minimalmodbus as mb
 import serial
-#mb.CLOSE_PORT_AFTER_EACH_CALL=True
+import serial.rs485
+import struct
+import time
+
+MAX_WRITE_REGS = 123 #Max. registers in one Modbus write multiple registers (FC16) frame
+_V_SCALE_OUT = 60.0/4096.0 #Volts per raw 12-bit DAC count
+_V_SCALE_IN  = 4096.0/60.0 #Raw 12-bit DAC counts per volt
+_MAX_TRIES   = 3           #Attempts per Modbus request before giving up on a missing/invalid response
+_RETRY_DELAY = 0.025       #Wait before retrying a failed request (s)
+_T_READ_CHUNK = 4          #Max. temp sensors per getTMulti request; each costs the slave a ~11ms scratchpad read
+_T_SERIAL_CHUNK = 31       #Max. temp sensors per getTSerialMulti request (4 registers each, 125 per Modbus read)
 
 class DacMaster:
     """This class defines methods to send and receive commands to the slave.
@@ -41,15 +51,83 @@ class DacMaster:
            must be the same as the variable NUM_BOARDS in the Arduino code.
     """
     
+    _port_cache = {}     #Open serial port objects shared by every DacMaster, keyed by port name
+    _port_refcounts = {} #Number of open DacMasters using each cached port
+    _port_last_tx = {}   #End time of the last transaction on each cached port, shared by its DacMasters
+    
     def __init__(self, slaveId, port, baudrate, numBoards=1, timeout=0.3):
+        cls = type(self)
+        port_obj = cls._port_cache.get(port)
         self.slave = mb.Instrument(port, slaveId)
-        self.slave.serial.baudrate = baudrate
-        self.slave.serial.timeout = timeout
-        self.slave.serial.bytesize = 8
-        self.slave.serial.parity = serial.PARITY_NONE
-        self.slave.serial.stopbits = 1
+        self.slave.close_port_after_each_call = False #Keep the port open for the lifetime of this DacMaster
+        if port_obj is not None and port_obj.is_open: #Reuse the already-configured open port
+            if self.slave.serial is not port_obj:
+                self.slave.serial.close()
+                self.slave.serial = port_obj
+        else:
+            self.slave.serial.apply_settings({ #Apply all the port settings together
+                'baudrate': baudrate, 'timeout': timeout,
+                'bytesize': 8, 'parity': serial.PARITY_NONE, 'stopbits': 1,
+            })
+            try: #Let the driver toggle DE/RE via RTS so the bus turns around right after TX
+                self.slave.serial.rs485_mode = serial.rs485.RS485Settings(
+                    rts_level_for_tx=True, rts_level_for_rx=False,
+                    delay_before_tx=None, delay_before_rx=None) #None, not 0: Windows rejects 0
+            except (ValueError, OSError, NotImplementedError, serial.SerialException): #Platform or adapter doesn't support it
+                self.slave.serial.rs485_mode = None
+            try: #Linux only: cut the USB-serial latency timer (16ms on FTDI) to 1ms
+                self.slave.serial.set_low_latency_mode(True)
+            except (AttributeError, ValueError, OSError, NotImplementedError): #Not supported by this platform or driver
+                pass
+            cls._port_cache[port] = self.slave.serial
+            #A cached port found closed still has its other DacMasters counted, so keep their refcount
+            cls._port_refcounts.setdefault(port, 0)
+            cls._port_last_tx.setdefault(port, 0.0)
+        cls._port_refcounts[port] += 1
+        self._port = port
+        #Read exactly the expected response length so each call returns as soon as the
+        # reply arrives; the timeout then only bounds the wait for a missing reply
+        self.slave.precalculate_read_size = True
+        self.slave.clear_buffers_before_each_transaction = True #Drop stale bytes before each request
         self.numBoards = numBoards
-        
+        self._t_base = 1 + self.numBoards*8 #Address of the 0th temp sensor's registers
+        #Bind the Instrument methods once rather than looking them up on every call
+        self._read_register = self.slave.read_register
+        self._read_registers = self.slave.read_registers
+        self._write_register = self.slave.write_register
+        self._write_registers = self.slave.write_registers
+        self._read_bit = self.slave.read_bit
+        self._write_bit = self.slave.write_bit
+        self._read_bits = self.slave.read_bits
+        self._write_bits = self.slave.write_bits
+        #Modbus RTU silent interval between frames: 3.5 chars of 11 bits each, min. 1.75ms.
+        # Use the port's own baudrate, which a reused port keeps from its first DacMaster
+        self._silent_interval = max(0.00175, 3.5 * (1 + 8 + 1 + 1) / self.slave.serial.baudrate)
+
+    def _transact(self, request, *args, **kwargs):
+        """Waits out whatever remains of the Modbus RTU silent interval since the last
+        transaction on this port (by any DacMaster sharing it), then performs the request
+        and timestamps its end. A request that gets no response or an invalid one is
+        retried, up to _MAX_TRIES attempts in all.
+
+        :param request: The minimalmodbus Instrument method to call
+        :returns: Whatever the request returns
+        """
+        last_tx = self._port_last_tx
+        port = self._port
+        for attempt in range(_MAX_TRIES):
+            dt = time.monotonic() - last_tx[port]
+            if dt < self._silent_interval:
+                time.sleep(self._silent_interval - dt)
+            try:
+                return request(*args, **kwargs)
+            except (mb.NoResponseError, mb.InvalidResponseError):
+                if attempt == _MAX_TRIES - 1:
+                    raise
+                time.sleep(_RETRY_DELAY) #Only delay when a request has failed
+            finally:
+                last_tx[port] = time.monotonic()
+
     def updateV(self, address, newRawV):
         """Updates the voltage in the DAC channel input register, then updates the DAC
         register by pulsing the LDAC pin. The DAC channel must then be powered on to
@@ -58,7 +136,21 @@ class DacMaster:
         :param newV: The raw integer voltage with which to update the DAC channel
         :param address: The address of the DAC channel
         """
-        self.slave.write_register(address, newRawV, functioncode=6)
+        self._transact(self._write_register, address, newRawV, functioncode=6)
+
+    def updateVMulti(self, startAddr, newRawVs):
+        """Updates the voltages in a contiguous block of DAC channel input registers,
+        writing up to MAX_WRITE_REGS channels per Modbus request. Each DAC register is
+        then updated by pulsing the LDAC pin.
+
+        :param startAddr: The address of the first DAC channel in the block
+        :param newRawVs: The raw integer voltages with which to update the DAC
+            channels, starting at startAddr
+        """
+        newRawVs = list(newRawVs)
+        for offset in range(0, len(newRawVs), MAX_WRITE_REGS): #Split runs too long for one frame
+            self._transact(self._write_registers, startAddr + offset,
+                           newRawVs[offset:offset + MAX_WRITE_REGS])
 
     def getV(self, address):
         """Returns the voltage for the DAC channel stored in the slave holding register
@@ -66,7 +158,7 @@ class DacMaster:
         :param address: The address of the DAC channel
         :returns: The voltage held in the slave
         """
-        return self.slave.read_register(address, functioncode=3)
+        return self._transact(self._read_register, address, functioncode=3)
 
     def readV(self, address):
         """Returns the approximate DAC input register voltage
@@ -75,15 +167,37 @@ class DacMaster:
         :param address: The address of the DAC channel
         :returns: The approximate voltage in the DAC channel input register
         """
-        return self.slave.read_register(address, functioncode=4)
-    
+        return self._transact(self._read_register, address, functioncode=4)
+
+    def getVMulti(self, startAddr, count):
+        """Returns the voltages for a contiguous block of DAC channels stored in the
+        slave holding registers, using a single Modbus request
+
+        :param startAddr: The address of the first DAC channel in the block
+        :param count: The number of contiguous DAC channels to read
+        :returns: A list of the raw voltages held in the slave, starting at startAddr
+        """
+        return self._transact(self._read_registers, startAddr, count, functioncode=3)
+
+    def readVMulti(self, startAddr, count):
+        """Returns the approximate DAC input register voltages for a contiguous block
+        of DAC channels, using a single Modbus request
+        WARNING: The lsb of each voltage is the second-to-last bit recorded
+
+        :param startAddr: The address of the first DAC channel in the block
+        :param count: The number of contiguous DAC channels to read
+        :returns: A list of the approximate voltages in the DAC channel input
+            registers, starting at startAddr
+        """
+        return self._transact(self._read_registers, startAddr, count, functioncode=4)
+
     def initT(self):
         """Initializes temperature sensor addresses and indices inside Arduino
         
         :returns: Number of temperature sensors on bus detected and addressed
         """
-        address = self.numBoards*2*4
-        numSensors_uint16 = self.slave.read_register(address, functioncode=4)
+        address = self._t_base - 1 #The register just before the first temp sensor
+        numSensors_uint16 = self._transact(self._read_register, address, functioncode=4)
         return numSensors_uint16 - 32768 #Convert 16-bit uint back to int
     
     def getTSerial(self, i):
@@ -92,11 +206,30 @@ class DacMaster:
         
         :returns: The 64-bit OneWire sensor address as a bytes object
         """
-        address = 1 + self.numBoards*2*4 + int(i)*4
+        address = self._t_base + (i<<2)
+        
+        #Read all 4 16-bit chunks of the address in one request, then pack them big-endian
+        regs = self._transact(self._read_registers, address, 4, functioncode=3)
+        return struct.pack('>4H', *regs)
+    
+    def getTSerialMulti(self, i, count):
+        """Outputs the 64-bit serial codes of count consecutive temperature sensors,
+        starting at the ith sensor, using one Modbus request per _T_SERIAL_CHUNK sensors
         
-        #Concatenate byte hex vals to get address
-        return b''.join([self.slave.read_register(address+i, functioncode=3)
-                                   .to_bytes(2,"big") for i in range(0,4)]) 
+        :param i: The index (starting at 0) of the first temp sensor
+        :param count: The number of consecutive temp sensors
+        :returns: A list of the 64-bit OneWire sensor addresses as bytes objects
+        """
+        if(i<0):
+            raise ValueError(f'Temperature sensor index must be a positive integer, not {i}')
+        end = i + int(count)
+        serials = []
+        for start in range(i, end, _T_SERIAL_CHUNK):
+            address = self._t_base + (start<<2)
+            n = min(_T_SERIAL_CHUNK, end - start)
+            regs = self._transact(self._read_registers, address, 4*n, functioncode=3)
+            serials += [struct.pack('>4H', *regs[j:j+4]) for j in range(0, 4*n, 4)]
+        return serials
     
     def getT(self, i):
         """Returns the recorded raw temperature from the ith temperature sensor
@@ -109,10 +242,32 @@ class DacMaster:
         """
         if(i<0):
             raise ValueError(f'Temperature sensor index must be a positive integer, not {i}')
-        address = 1 + self.numBoards*2*4 + int(i)*4
-        temp_uint16 = self.slave.read_register(address, functioncode=4)
+        address = self._t_base + (i<<2)
+        temp_uint16 = self._transact(self._read_register, address, functioncode=4)
         return temp_uint16 - 32768 #Convert 16-bit uint back to int
-    
+
+    def getTMulti(self, i, count):
+        """Returns the recorded raw temperatures from count consecutive temperature
+        sensors on the temp sensor data bus, starting at the ith sensor, using one
+        Modbus request per _T_READ_CHUNK sensors. Must wait 750ms max after recordT()
+        to get updated values (for 12-bit precision).
+
+        :param i: The index (starting at 0) of the first temp sensor to read
+        :param count: The number of consecutive temp sensors to read
+        :returns: A list of the raw temperature readings, starting at the ith sensor
+        """
+        if(i<0):
+            raise ValueError(f'Temperature sensor index must be a positive integer, not {i}')
+        end = i + int(count)
+        temps_uint16 = []
+        #Split the read so each reply (and the slave's scratchpad reads) fits in the timeout
+        for start in range(i, end, _T_READ_CHUNK):
+            address = self._t_base + (start<<2)
+            n = min(_T_READ_CHUNK, end - start)
+            #Each sensor spans 4 registers; the temperature is in the first of them
+            temps_uint16 += self._transact(self._read_registers, address, 4*n, functioncode=4)[::4]
+        return [t - 32768 for t in temps_uint16] #Convert 16-bit uints back to ints
+
     def recordT(self, i):
         """Records the temperature on the ith temperature sensor on the temp
         sensor data bus
@@ -121,22 +276,48 @@ class DacMaster:
             sensor is closest on the bus to the Arduino
         :returns: False if sensor is disconnected; True otherwise
         """
-        address = 1 + self.numBoards*2*4 + int(i)*4
-        return self.slave.read_bit(address, functioncode=1)
+        if(i<0):
+            raise ValueError(f'Temperature sensor index must be a positive integer, not {i}')
+        address = self._t_base + (i<<2)
+        return self._transact(self._read_bit, address, functioncode=1)
+
+    def recordTMulti(self, i, count):
+        """Records the temperature on every sensor on the temp sensor data bus at once,
+        using a single Modbus request, e.g. before reading count consecutive sensors
+        starting at the ith with getTMulti()
+
+        :param i: The index (starting at 0) of the first temp sensor to be read
+        :param count: The number of consecutive temp sensors to be read
+        :returns: A list, starting at the ith sensor, of True for each sensor whose
+            conversion was requested
+        """
+        address = self._t_base + (i<<2)
+        #Each sensor spans 4 coils; the result is in the first of them
+        bits = self._transact(self._read_bits, address, 4*int(count), functioncode=1)[::4]
+        return [bool(bit) for bit in bits]
+
+    def isTReady(self):
+        """Returns whether the temperature sensors have finished the conversion started
+        by recordT() or recordTMulti(). Sensors on parasite power always report False.
+
+        :returns: True if the conversion is complete; False otherwise
+        """
+        address = self._t_base - 1 #The coil just before the first temp sensor
+        return bool(self._transact(self._read_bit, address, functioncode=1))
 
     def powerUp(self, address):
         """Powers on the DAC channel analog output.
         
         :param address: The address of the DAC channel
         """
-        self.slave.write_bit(address, 1, functioncode=5)
+        self._transact(self._write_bit, address, 1, functioncode=5)
 
     def powerDown(self, address):
         """Powers off the DAC channel analog output
         
         :param address: The address of the DAC channel
         """
-        self.slave.write_bit(address, 0, functioncode=5)
+        self._transact(self._write_bit, address, 0, functioncode=5)
 
     def getPower(self, address):
         """Returns whether power to the DAC channel analog output
@@ -146,8 +327,37 @@ class DacMaster:
         :returns: True if power to the analog channel was switched on; False if it
             was switched off. The DACs default to off.
         """
-        return self.slave.read_bit(address, functioncode=1)
+        return self._transact(self._read_bit, address, functioncode=1)
                                    
+    def powerUpMulti(self, startAddr, count):
+        """Powers on the analog outputs of a contiguous block of DAC channels, using a
+        single Modbus request
+
+        :param startAddr: The address of the first DAC channel in the block
+        :param count: The number of contiguous DAC channels to power on
+        """
+        self._transact(self._write_bits, startAddr, [1]*count)
+
+    def powerDownMulti(self, startAddr, count):
+        """Powers off the analog outputs of a contiguous block of DAC channels, using a
+        single Modbus request
+
+        :param startAddr: The address of the first DAC channel in the block
+        :param count: The number of contiguous DAC channels to power off
+        """
+        self._transact(self._write_bits, startAddr, [0]*count)
+
+    def getPowerMulti(self, startAddr, count):
+        """Returns whether power to the analog outputs of a contiguous block of DAC
+        channels is on or off in the slave coils, using a single Modbus request
+
+        :param startAddr: The address of the first DAC channel in the block
+        :param count: The number of contiguous DAC channels to read
+        :returns: A list of 1 for each channel switched on and 0 for each switched
+            off, starting at startAddr
+        """
+        return self._transact(self._read_bits, startAddr, count, functioncode=1)
+
     def address(self, dacChan, dacNum, boardNum=0, sipmChan=0):
         """Outputs the address to use given the DAC channel IDs
 
@@ -160,9 +370,25 @@ class DacMaster:
         return self.numBoards*4*2*sipmChan + (4*2*boardNum + (4*dacNum + dacChan))
     
     def close(self):
-        """Closes the serial port
+        """Closes the serial port once no other open DacMaster is using it
+        """
+        cls = type(self)
+        if self._port is None: #Already closed
+            return
+        cls._port_refcounts[self._port] -= 1
+        if cls._port_refcounts[self._port] <= 0:
+            del cls._port_refcounts[self._port]
+            del cls._port_last_tx[self._port]
+            cls._port_cache.pop(self._port).close()
+        self._port = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        """Closes the serial port on leaving a with block, even if a command raised
         """
-        self.slave.serial.close()
+        self.close()
 
     @staticmethod
     def convertToActualV(rawV):
@@ -171,7 +397,18 @@ class DacMaster:
         :param rawV: The 12-bit unsigned integer output by many DacMaster functions
         :returns: The floating-point equivalent of rawV
         """
-        return rawV * 60.0/4096.0
+        return rawV * _V_SCALE_OUT
+
+    @staticmethod
+    def convertToActualVArray(rawVs):
+        """Converts a sequence of raw 12-bit voltages, e.g. from getVMulti(), to their
+        floating-point values all at once. Requires NumPy.
+
+        :param rawVs: The 12-bit unsigned integers output by many DacMaster functions
+        :returns: A NumPy float array of the floating-point equivalents of rawVs
+        """
+        import numpy as np
+        return np.asarray(rawVs, dtype=float) * _V_SCALE_OUT
 
     @staticmethod
     def convertToRawV(actualV):
@@ -183,8 +420,24 @@ class DacMaster:
         """
         if (actualV < 0 or actualV > 60):
             raise ValueError('The voltage to convert must be between 0 and 60 inclusive')
-        rawV = (int)(actualV * 4096.0/60.0)
-        return rawV if rawV < 4096 else 4095 #rawV must be a 12 bit number or less
+        rawV = (int)(actualV * _V_SCALE_IN)
+        return min(rawV, 4095) #rawV must be a 12 bit number or less
+    
+    @staticmethod
+    def convertToRawVArray(actualVs):
+        """
+        Converts a sequence of floating-point voltages (in volts, between 0 and 60
+        inclusive) to their raw 12-bit values all at once, e.g. for updateVMulti().
+        Requires NumPy.
+        :param actualVs: The floating-point voltage values to convert
+        :returns: A NumPy uint16 array of the 12-bit raw voltage equivalents of actualVs
+        """
+        import numpy as np
+        actualVs = np.asarray(actualVs, dtype=float)
+        if (np.any(actualVs < 0) or np.any(actualVs > 60)):
+            raise ValueError('The voltages to convert must be between 0 and 60 inclusive')
+        #Truncate like convertToRawV, then clamp to a 12 bit number or less
+        return np.clip((actualVs * _V_SCALE_IN).astype(np.int32), 0, 4095).astype(np.uint16)
     
     @staticmethod
     def convertToDegC(rawTemp):
@@ -199,6 +452,21 @@ class DacMaster:
             return TEMP_DEVICE_DISCONNECTED_C
         #C = RAW/128
         return rawTemp * 0.0078125
+    
+    @staticmethod
+    def convertToDegCArray(rawTemps):
+        """Converts a sequence of raw temperatures, e.g. from getTMulti(), to their
+        floating-point values all at once. Requires NumPy.
+
+        :param rawTemps: The 16-bit temps output from the DallasTemperature library
+        :returns: A NumPy float array of the floating-point equivalents of rawTemps
+        """
+        import numpy as np
+        TEMP_DEVICE_DISCONNECTED_RAW = -7040
+        TEMP_DEVICE_DISCONNECTED_C = -127
+        rawTemps = np.asarray(rawTemps, dtype=np.int32)
+        return np.where(rawTemps <= TEMP_DEVICE_DISCONNECTED_RAW,
+                        float(TEMP_DEVICE_DISCONNECTED_C), rawTemps * 0.0078125)
 
 def main():
     """A DacMaster Demo Program: This updates the specified DAC with the
@@ -0,0 +1,297 @@
+'''
+This program defines an asyncio version of the DacMaster class to control DACs
+hosted by an Arduino slave via the Modbus RTU RS485 protocol for the APT
+experiment CERN prototype. RTU frames are built and checked locally and sent
+with pyserial-asyncio, so several DacMasterAsync objects (e.g. one per slave ID)
+can share one RS485 bus from the same event loop.
+
+..  moduleauthor:: Austin Stover <stover.a@wustl.edu>
+    :date: June 2018-Sept 2020
+
+Copyright (C) 2020  Austin Stover
+
+This file is part of APTDacManager.
+
+    APTDacManager is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    APTDacManager is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with APTDacManager.  If not, see <https://www.gnu.org/licenses/>.
+'''
+
+import array
+import asyncio
+import struct
+import time
+import weakref
+
+import serial
+import serial_asyncio
+
+def _make_crc_table():
+    """Returns the 256-entry lookup table for the Modbus CRC16 (reflected polynomial 0xA001)
+    """
+    table = array.array('H')
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC_TABLE = _make_crc_table()
+
+def _crc16(frame, table=_CRC_TABLE):
+    """Returns the Modbus RTU CRC16 of a frame, one table lookup per byte
+
+    :param frame: The bytes to checksum
+    :returns: The 16-bit CRC, to be sent low byte first
+    """
+    crc = 0xFFFF
+    for byte in frame:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+class _Bus:
+    """The shared state of one open RS485 bus: its stream pair and the lock that keeps
+    one request/reply on the (half-duplex) bus at a time
+    """
+    def __init__(self, reader, writer, silent_interval):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+        self.silent_interval = silent_interval
+        self.last_tx = 0.0
+        self.refcount = 0
+        self.stale = False #Set when a reply timed out or was garbled, so stray bytes may follow
+
+class DacMasterAsync:
+    """This class defines coroutines to send and receive commands to the slave.
+    They mirror the DacMaster methods of the same names.
+
+    The constructor instantiates a DacMasterAsync using the Modbus RTU protocol over
+    RS485. Await open() before sending any commands. DacMasterAsync objects on the same
+    port and event loop share one connection; each request waits for the bus, but frames are built and
+    replies decoded outside of the bus lock so other coroutines can run meanwhile.
+
+    :param slaveId: The ID number to use for the slave
+    :param port: The serial port to use
+    :param baudrate: Compatible baud rates: 4800, 9600, 14400, 19200, 28800
+    :param timeout: The max. length of time to wait for a slave to respond (s)
+    :param numBoards: The number of DAC boards hooked up to the slave. This
+           must be the same as the variable NUM_BOARDS in the Arduino code.
+    """
+
+    #Open buses shared by every DacMasterAsync, as {event loop: {port name: bus}}, since a bus's
+    # lock and streams only work in the loop that made them
+    _buses = weakref.WeakKeyDictionary()
+    _open_locks = weakref.WeakKeyDictionary() #{event loop: lock held while opening a port}
+
+    def __init__(self, slaveId, port, baudrate, numBoards=1, timeout=0.3):
+        self.slaveId = slaveId
+        self.port = port
+        self.baudrate = baudrate
+        self.numBoards = numBoards
+        self.timeout = timeout
+        self._t_base = 1 + self.numBoards*8 #Address of the 0th temp sensor's registers
+        self._bus = None
+        self._loop = None
+
+    async def open(self):
+        """Opens the serial port, or joins the connection already open on it
+        """
+        loop = asyncio.get_running_loop()
+        if self._bus is not None and self._loop is loop:
+            return
+        cls = type(self)
+        lock = cls._open_locks.get(loop)
+        if lock is None:
+            lock = cls._open_locks[loop] = asyncio.Lock()
+        async with lock: #Two objects opening the same port at once must share one connection
+            buses = cls._buses.setdefault(loop, {})
+            bus = buses.get(self.port)
+            if bus is None:
+                reader, writer = await self._open_connection()
+                #Modbus RTU silent interval between frames: 3.5 chars of 11 bits each, min. 1.75ms
+                bus = _Bus(reader, writer, max(0.00175, 3.5 * (1 + 8 + 1 + 1) / self.baudrate))
+                buses[self.port] = bus
+            bus.refcount += 1
+            self._bus = bus
+            self._loop = loop
+
+    async def _open_connection(self):
+        return await serial_asyncio.open_serial_connection(
+            url=self.port, baudrate=self.baudrate, bytesize=8,
+            parity=serial.PARITY_NONE, stopbits=1)
+
+    async def _resync(self, bus):
+        """Drops anything left on the bus by a failed request, so it can't be read as the
+        reply to the next one. Call with the bus lock held.
+        """
+        await asyncio.sleep(self.timeout) #Let a late reply finish arriving
+        #Reopening the port discards both the stream's buffer and the OS input buffer
+        bus.writer.close()
+        await bus.writer.wait_closed()
+        bus.reader, bus.writer = await self._open_connection()
+        bus.stale = False
+
+    async def _transact(self, pdu, responseLen):
+        """Sends one request to the slave and returns the PDU of its reply
+
+        :param pdu: The function code and data of the request
+        :param responseLen: The expected length of the whole reply frame in bytes
+        :returns: The function code and data of the reply
+        """
+        if self._bus is None:
+            raise RuntimeError('DacMasterAsync.open() must be awaited before sending commands')
+        frame = bytes([self.slaveId]) + pdu
+        frame += struct.pack('<H', _crc16(frame))
+        bus = self._bus
+        async with bus.lock:
+            if bus.stale:
+                await self._resync(bus)
+            dt = time.monotonic() - bus.last_tx
+            if dt < bus.silent_interval:
+                await asyncio.sleep(bus.silent_interval - dt)
+            try:
+                bus.writer.write(frame)
+                await bus.writer.drain()
+                #An exception reply is 5 bytes, so read its header before the rest of the frame
+                reply = await asyncio.wait_for(bus.reader.readexactly(3), self.timeout)
+                remaining = 2 if reply[1] & 0x80 else responseLen - 3
+                reply += await asyncio.wait_for(bus.reader.readexactly(remaining), self.timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                bus.stale = True #The rest of this reply may still arrive
+                raise
+            finally:
+                bus.last_tx = time.monotonic()
+        if struct.unpack('<H', reply[-2:])[0] != _crc16(reply[:-2]):
+            bus.stale = True #Out of step with the slave's frames
+            raise IOError(f'Bad CRC in the reply from slave {self.slaveId}: {reply.hex()}')
+        if reply[0] != self.slaveId:
+            bus.stale = True #e.g. a late reply to an earlier request
+            raise IOError(f'Reply came from slave {reply[0]}, not slave {self.slaveId}')
+        if reply[1] & 0x80:
+            raise IOError(f'Slave {self.slaveId} reported Modbus exception code {reply[2]}')
+        return reply[1:-2]
+
+    async def _read_registers(self, address, count, functioncode):
+        pdu = await self._transact(struct.pack('>BHH', functioncode, address, count), 5 + 2*count)
+        return list(struct.unpack(f'>{count}H', pdu[2:]))
+
+    async def _read_bit(self, address):
+        pdu = await self._transact(struct.pack('>BHH', 1, address, 1), 6)
+        return pdu[2] & 1
+
+    async def _write_bit(self, address, value):
+        await self._transact(struct.pack('>BHH', 5, address, 0xFF00 if value else 0), 8)
+
+    async def updateV(self, address, newRawV):
+        """Updates the voltage in the DAC channel input register, then updates the DAC
+        register by pulsing the LDAC pin. The DAC channel must then be powered on to
+        output the voltage.
+
+        :param newV: The raw integer voltage with which to update the DAC channel
+        :param address: The address of the DAC channel
+        """
+        await self._transact(struct.pack('>BHH', 6, address, newRawV), 8)
+
+    async def getV(self, address):
+        """Returns the voltage for the DAC channel stored in the slave holding register
+
+        :param address: The address of the DAC channel
+        :returns: The voltage held in the slave
+        """
+        return (await self._read_registers(address, 1, 3))[0]
+
+    async def readV(self, address):
+        """Returns the approximate DAC input register voltage
+        WARNING: The lsb of this voltage is the second-to-last bit recorded
+
+        :param address: The address of the DAC channel
+        :returns: The approximate voltage in the DAC channel input register
+        """
+        return (await self._read_registers(address, 1, 4))[0]
+
+    async def getT(self, i):
+        """Returns the recorded raw temperature from the ith temperature sensor
+        on the temp sensor data bus. Must wait 750ms max after recordT() to get
+        updated values (for 12-bit precision).
+
+        :param i: The index (starting at 0) of the temp sensor to read. The 0th
+            sensor is closest on the bus to the Arduino
+        :returns: The raw temperature reading
+        """
+        if(i<0):
+            raise ValueError(f'Temperature sensor index must be a positive integer, not {i}')
+        address = self._t_base + (i<<2)
+        temp_uint16 = (await self._read_registers(address, 1, 4))[0]
+        return temp_uint16 - 32768 #Convert 16-bit uint back to int
+
+    async def recordT(self, i):
+        """Records the temperature on the ith temperature sensor on the temp
+        sensor data bus
+
+        :param i: The index (starting at 0) of the temp sensor to read. The 0th
+            sensor is closest on the bus to the Arduino
+        :returns: False if sensor is disconnected; True otherwise
+        """
+        if(i<0):
+            raise ValueError(f'Temperature sensor index must be a positive integer, not {i}')
+        address = self._t_base + (i<<2)
+        return await self._read_bit(address)
+
+    async def powerUp(self, address):
+        """Powers on the DAC channel analog output.
+
+        :param address: The address of the DAC channel
+        """
+        await self._write_bit(address, 1)
+
+    async def powerDown(self, address):
+        """Powers off the DAC channel analog output
+
+        :param address: The address of the DAC channel
+        """
+        await self._write_bit(address, 0)
+
+    async def getPower(self, address):
+        """Returns whether power to the DAC channel analog output
+        is on or off in the slave coil
+
+        :param address: The address of the DAC channel
+        :returns: True if power to the analog channel was switched on; False if it
+            was switched off. The DACs default to off.
+        """
+        return await self._read_bit(address)
+
+    def address(self, dacChan, dacNum, boardNum=0, sipmChan=0):
+        """Outputs the address to use given the DAC channel IDs
+
+        :param dacChan: Specifies the channel on the DAC (0-3)
+        :param dacNum: Specifies the DAC on the board (0-1)
+        :param boardNum: Specifies the board
+        :param sipmChan: Specifies the SiPM channel
+        :returns: The DAC channel address
+        """
+        return self.numBoards*4*2*sipmChan + (4*2*boardNum + (4*dacNum + dacChan))
+
+    async def close(self):
+        """Closes the serial port once no other open DacMasterAsync is using it
+        """
+        bus = self._bus
+        if bus is None: #Already closed
+            return
+        loop, self._bus, self._loop = self._loop, None, None
+        bus.refcount -= 1
+        if bus.refcount <= 0:
+            del type(self)._buses[loop][self.port]
+            bus.writer.close()
+            await bus.writer.wait_closed() #So the port is free for the next open()
@@ -172,7 +172,10 @@ void loop()
  */
 
 /**
- * Callback function for a single holding register write (input registers can only be read)
+ * Callback function for single and multiple holding register writes (input registers can only be read)
+ *
+ * A multiple register write must lie entirely within the DAC channel block. Each DAC channel
+ * in the block is updated in turn.
  */
 uint8_t writeReg(uint8_t fc, uint16_t address, uint16_t length)
 {
@@ -186,6 +189,19 @@ uint8_t writeReg(uint8_t fc, uint16_t address, uint16_t length)
       updateV(slave.readRegisterFromBuffer(0), address);
       return STATUS_OK;
     }
+    else
+      return STATUS_ILLEGAL_DATA_ADDRESS;
+  }
+  else if(fc == FC_WRITE_MULTIPLE_REGISTERS)
+  {
+    if(address + length <= DAC_V_LEN)
+    {
+      for(uint16_t i = 0; i < length; i++)
+        updateV(slave.readRegisterFromBuffer(i), address + i);
+      return STATUS_OK;
+    }
+    else
+      return STATUS_ILLEGAL_DATA_ADDRESS;
   }
   else
     return STATUS_ILLEGAL_FUNCTION;
@@ -193,19 +209,26 @@ uint8_t writeReg(uint8_t fc, uint16_t address, uint16_t length)
 
 /**
  * Callback function for input/holding register reads
+ *
+ * A multi-register read must lie entirely within the DAC channel block or entirely
+ * within the temp sensor block. Each register in the block is written to the buffer in turn.
  */
 uint8_t readReg(uint8_t fc, uint16_t address, uint16_t length)
 {
+  uint16_t lastAddress = address + length - 1;
+
   if(fc == FC_READ_HOLDING_REGISTERS) //Reading a holding register returns the voltage in the register
   { //Holding regs are 16 bit read/write
-    if(address < DAC_V_LEN)
+    if(lastAddress < DAC_V_LEN)
     {
-      slave.writeRegisterToBuffer(0, getV(address));
+      for(uint16_t i = 0; i < length; i++)
+        slave.writeRegisterToBuffer(i, getV(address + i));
       return STATUS_OK;
     }
-    else if(address > DAC_V_LEN and address <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN*4)
+    else if(address > DAC_V_LEN and lastAddress <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN*4)
     {
-      slave.writeRegisterToBuffer(0, getTAddrShort(address));
+      for(uint16_t i = 0; i < length; i++)
+        slave.writeRegisterToBuffer(i, getTAddrShort(address + i));
       return STATUS_OK;
     }
     else
@@ -215,40 +238,54 @@ uint8_t readReg(uint8_t fc, uint16_t address, uint16_t length)
   { //Reading an input register reads the voltage from a DAC register
     //  or reads a temperature sensor, depending on the address
     //Input regs are 16 bit read-only
-    if(address < DAC_V_LEN)
+    if(lastAddress < DAC_V_LEN)
     {
-      slave.writeRegisterToBuffer(0, readV(address));
+      for(uint16_t i = 0; i < length; i++)
+        slave.writeRegisterToBuffer(i, readV(address + i));
       return STATUS_OK;
     }
-    else if(address == DAC_V_LEN)
+    else if(address == DAC_V_LEN and length == 1)
     {
       int16_t numSensors_int16 = initTs();
       slave.writeRegisterToBuffer( 0, (uint16_t)(((int32_t)numSensors_int16)+32768) );
       return STATUS_OK;
     }
-    else if(address > DAC_V_LEN and address <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN*4)
-    { 
+    else if(address > DAC_V_LEN and lastAddress <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN*4)
+    {
       //Read (address-n)th temp sensor on temp data bus if address doesn't
       // correspond to a DAC, where n=DAC_V_LEN
       //Serial.print("\t11. "); Serial.print(address);
-      slave.writeRegisterToBuffer(0, (uint16_t)(getT(address)));
+      for(uint16_t i = 0; i < length; i++)
+      {
+        //Only the first of the 4 registers per sensor holds the temperature, so
+        // skip the 1-wire scratchpad read for the other 3 in a block read
+        if(length > 1 and (address + i - 1 - DAC_V_LEN) % 4 != 0)
+          slave.writeRegisterToBuffer(i, 0);
+        else
+          slave.writeRegisterToBuffer(i, (uint16_t)(getT(address + i)));
+      }
       return STATUS_OK;
     }
+    else
+      return STATUS_ILLEGAL_DATA_ADDRESS;
   }
   else
     return STATUS_ILLEGAL_FUNCTION;
 }
 
 /**
- * Callback function for writing single bits to turn on/off DAC channel analog outputs
+ * Callback function for writing bits to turn on/off DAC channel analog outputs
+ *
+ * A multiple coil write must lie entirely within the DAC channel block.
  */
 uint8_t writeCoil(uint8_t fc, uint16_t address, uint16_t length)
 { //Coils are 1 bit read/write
-  if(fc == FC_WRITE_COIL)
+  if(fc == FC_WRITE_COIL or fc == FC_WRITE_MULTIPLE_COILS)
   {
-    if(address < DAC_V_LEN)
+    if(address + length <= DAC_V_LEN)
     {
-      power(slave.readCoilFromBuffer(0), address);
+      for(uint16_t i = 0; i < length; i++)
+        power(slave.readCoilFromBuffer(i), address + i);
       return STATUS_OK;
     }
     else
@@ -259,22 +296,41 @@ uint8_t writeCoil(uint8_t fc, uint16_t address, uint16_t length)
 }
 
 /**
- * Callback function for reading single bits returns the DAC channel power boolean in the coil
+ * Callback function for reading bits returns the DAC channel power booleans in the coils
+ *
+ * A multiple coil read must lie entirely within the DAC channel block or entirely within
+ * the temp sensor block. A multiple read of the temp sensor coils starts a conversion on every
+ * sensor on the bus at once; a single read starts one on that sensor only. The single coil
+ * between the two blocks reads whether the last temperature conversion has finished.
  */
 uint8_t readCoil(uint8_t fc, uint16_t address, uint16_t length)
 { //Coils are 1 bit read/write
   if(fc == FC_READ_COILS)
   {
-    if(address < DAC_V_LEN)
+    if(address + length <= DAC_V_LEN)
     {
-      slave.writeCoilToBuffer(0, getPower(address));
+      for(uint16_t i = 0; i < length; i++)
+        slave.writeCoilToBuffer(i, getPower(address + i));
       return STATUS_OK;
     }
-    else if(address > DAC_V_LEN and address <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN)
+    else if(length == 1 and address == DAC_V_LEN)
+    {
+      slave.writeCoilToBuffer(0, isTReady());
+      return STATUS_OK;
+    }
+    else if(length == 1 and address > DAC_V_LEN and address <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN*4)
     {
       slave.writeCoilToBuffer(0, recordT(address));
       return STATUS_OK;
     }
+    else if(address > DAC_V_LEN and address + length - 1 <= DAC_V_LEN + TEMP_ADDR_ARRAY_LEN*4)
+    {
+      //One broadcast (SKIP ROM + CONVERT T) so every sensor converts in parallel
+      temp_sensors.requestTemperatures();
+      for(uint16_t i = 0; i < length; i++) //Set the first coil of each sensor
+        slave.writeCoilToBuffer(i, (address + i - 1 - DAC_V_LEN) % 4 == 0);
+      return STATUS_OK;
+    }
     else
       return STATUS_ILLEGAL_DATA_ADDRESS;
   }
@@ -450,6 +506,16 @@ bool recordT(uint16_t address)
   return temp_sensors.requestTemperaturesByAddress(tempAddrArray[index].bytes);
 }
 
+/**
+ * Returns whether the temperature conversions started by recordT() have finished. Sensors
+ * on parasite power can't signal this, so they always report false and the master waits
+ * out the full conversion time instead.
+ */
+bool isTReady()
+{
+  return !temp_sensors.isParasitePowerMode() and temp_sensors.isConversionComplete();
+}
+
 /**
  * Gets the temperature previously recorded by the sensor on the bus corresponding to the address
  * 
@@ -29,10 +29,10 @@ This file is part of APTDacManager.
     along with APTDacManager.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from DacMaster import DacMaster as dm
 import argparse
-import pickle
 import os
+import struct
+import sys
 import time
 
 ### DEFAULTS
@@ -44,97 +44,576 @@ NUM_BOARDS      = 4                 #The default number of DAC boards connected
 SLAVE_ID        = 1                 #The default slave ID to use. Must be the same as SLAVE_ID in the Arduino code.
 BAUD_RATE       = 9600              #The default serial baud rate for communication with the Arduino.
 TIMEOUT         = 0.3               #The modbus serial timeout. Waits no longer for a modbus message response from the Arduino.
+SOCKET_FILE     = '/tmp/aptdac.sock'#The Unix socket a 'daemon --socket' listens on. Commands are forwarded to it when it exists.
+SOCKET_TIMEOUT  = 30                #The longest a forwarded command may take in the daemon (e.g. readT re-finding its sensors), in s.
+
+TEMP_DISCONNECTED_RAW = -7040      #The raw temperature DallasTemperature reports for a sensor it can't reach.
+T_CONVERSION_TIME = 0.75           #The longest a temperature conversion takes (12-bit precision), in s.
+T_POLL_INTERVAL = 0.02             #How often to ask the Arduino whether a temperature conversion has finished, in s.
+
+ALL_ALIASES     = frozenset(('all','All','ALL'))  #Entering one of these as the first alias selects every alias
+DAC_DIR_LINE    = r'^[ \t]*([^\s#]+)[ \t]+([^\n#]+)' #A DAC directory line: its alias, then the channel IDs before any comment
+TEMP_DIR_LINE   = r'^[ \t]*([^#\n]*?)[ \t]*(?:#.*)?$' #A temperature directory line: everything before any comment
 
 ### HANDLE PERSISTING VARIABLES
 
 VAR_FILE_DIR = ''
-VAR_FILE_NAME = 'cmd_UI_vars.obj' #Should have extension '.obj' in it
+VAR_FILE_NAME = 'cmd_UI_vars.bin' #Should have extension '.bin' in it
+
+O_BINARY = getattr(os, 'O_BINARY', 0) #Windows opens files in text mode without this flag
 
 varFileAbsDir = os.path.join(os.path.dirname(__file__),VAR_FILE_DIR,VAR_FILE_NAME) #Absolute directory
 
+#Persisting variable file layout (little-endian):
+#  slaveId, baudrate, numBoards, len(port) ('<iIII'), timeout ('<d'), port (UTF-8)
+#  len(addressDict) ('<I'), then per alias: len(alias) ('<B'), alias (UTF-8), address ('<i')
+#  len(tempDict) ('<I'), then per alias: len(alias) ('<B'), alias (UTF-8), serial num ('<Q')
+#  len(tempIndexDict) ('<I'), then per alias: len(alias) ('<B'), alias (UTF-8), index on the bus ('<i')
+
+def save_vars(path, persisting_vars): #Pack the persisting variables into the binary var file
+    port = persisting_vars['port'].encode()
+    chunks = [struct.pack('<iIIId', persisting_vars['slaveId'], persisting_vars['baudrate'],
+                          persisting_vars['numBoards'], len(port), persisting_vars['timeout']), port]
+    for entries, fmt in ((persisting_vars['addressDict'], '<i'), (persisting_vars['tempDict'], '<Q'),
+                         (persisting_vars['tempIndexDict'], '<i')):
+        chunks.append(struct.pack('<I', len(entries)))
+        for alias, val in entries.items():
+            alias = alias.encode()
+            if len(alias) > 255: #Its length has to fit the '<B' field
+                print(f"Error: The alias '{alias.decode()[:20]}...' is longer than 255 bytes; use a shorter alias.")
+                sys.exit(1)
+            chunks += [struct.pack('<B', len(alias)), alias, struct.pack(fmt, val)]
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o644)
+    try:
+        os.write(fd, b''.join(chunks))
+    finally:
+        os.close(fd)
+
+def load_vars(path): #Unpack the persisting variables from one read of the var file
+    fd = os.open(path, os.O_RDONLY | O_BINARY)
+    try:
+        buf = os.read(fd, os.fstat(fd).st_size) #The file is small, so one read gets all of it
+    finally:
+        os.close(fd)
+    slaveId, baudrate, numBoards, portLen, timeout = struct.unpack_from('<iIIId', buf)
+    offset = struct.calcsize('<iIIId')
+    port = buf[offset:offset+portLen].decode()
+    offset += portLen
+    dicts = []
+    for fmt in ('<i', '<Q', '<i'):
+        entries = {}
+        numEntries, = struct.unpack_from('<I', buf, offset)
+        offset += 4
+        for _ in range(numEntries):
+            aliasLen = buf[offset]
+            alias = buf[offset+1:offset+1+aliasLen].decode()
+            offset += 1 + aliasLen
+            entries[alias], = struct.unpack_from(fmt, buf, offset)
+            offset += struct.calcsize(fmt)
+        dicts.append(entries)
+    return {'slaveId': slaveId, 'port': port, 'baudrate': baudrate, 'numBoards': numBoards,
+            'timeout': timeout, 'addressDict': dicts[0], 'tempDict': dicts[1], 'tempIndexDict': dicts[2]}
+
+daemon_vars = None #Set by the daemon command so every command shares one open cntrl object
+
+vars_cache = {} #{var file mtime: persisting vars}, so repeated commands in one process skip re-reading the file
+
+def load_persisting_vars(): #Load the persisting vars, reusing the last load while the var file is unchanged
+    mtime = os.path.getmtime(varFileAbsDir)
+    if mtime not in vars_cache:
+        vars_cache.clear()
+        vars_cache[mtime] = load_vars(varFileAbsDir)
+    return vars_cache[mtime]
+
+def load_state(): #Unpack the alias dicts from the var file without touching the serial port
+    if daemon_vars is not None:
+        return daemon_vars[1:]
+    persisting_vars = load_persisting_vars()
+    addressDict = persisting_vars['addressDict']
+    tempDict    = persisting_vars['tempDict']
+    iv_tempDict = {serialNum: alias for alias,serialNum in tempDict.items()} #Inverse dict: serial num -> alias
+    return addressDict, tempDict, iv_tempDict
+
+def get_cntrl(): #Open the serial port, only once a command is ready to talk to the slave
+    if daemon_vars is not None: #Reuse the daemon's open serial port
+        return daemon_vars[0]
+    from DacMaster import DacMaster as dm #Import the serial stack only once a command needs the slave
+    persisting_vars = load_persisting_vars()
+    return dm(persisting_vars['slaveId'], persisting_vars['port'], persisting_vars['baudrate'],
+              persisting_vars['numBoards'], persisting_vars['timeout'])
+
 def init_command(): #Unpack vars from file and reinitialize cntrl object
-    persisting_vars = pickle.load(open(varFileAbsDir, 'rb'))
-    #print(*persisting_vars[:-1])
-    cntrl = dm(*persisting_vars[:-3])
-    addressDict = persisting_vars[-3]
-    tempDict    = persisting_vars[-2]
-    iv_tempDict = persisting_vars[-1]
-    return cntrl, addressDict, tempDict, iv_tempDict
+    return (get_cntrl(), *load_state())
+
+def close_command(cntrl): #Close the serial port unless the daemon is keeping it open
+    if daemon_vars is None:
+        cntrl.close()
 
+def group_runs(chanAddrs): #Group (alias, address) pairs into runs of consecutive addresses
+    runs = [] #List of (start address, [aliases]) so each run can be sent as one modbus request
+    for alias, address in sorted(chanAddrs, key=lambda pair: pair[1]):
+        if runs and address == runs[-1][0] + len(runs[-1][1]):
+            runs[-1][1].append(alias)
+        else: #Gap (or duplicate address): start a new run
+            runs.append((address, [alias]))
+    return runs
 
-### DEFINE COMMAND LINE PARSERS
-def return_parser():
-    psr = argparse.ArgumentParser(description='Control Voltages on the DACs ' +
-                                  'and read temperature sensors with this ' +
-                                  'interface. Make sure cmdUI.py is on your ' +
-                                  'PythonPath before use.')
-    subpsrs = psr.add_subparsers()
+def expand_all(aliases, aliasDict): #If 'all' entered, use every alias in the dict (as a view, not a copy)
+    return aliasDict.keys() if aliases and aliases[0] in ALL_ALIASES else aliases
+
+def lookup_chans(addressDict, chans): #Return (alias, address) pairs; exit if an alias isn't in the DAC directory
+    if chans and chans[0] in ALL_ALIASES: #Take the pairs straight from the dict instead of looking each key back up
+        chanAddrs = list(addressDict.items())
+    else:
+        try:
+            chanAddrs = [(chan, addressDict[chan]) for chan in chans]
+        except KeyError as err:
+            print('Error: DAC channel address for',err.args[0],'not found. See ' +
+                  'DacDir.txt or the DAC directory file you specified for ' +
+                  'a list of available DAC names.')
+            sys.exit(1)
+    if not chanAddrs: #Nothing entered, or 'all' with an empty DAC directory
+        print("Error: Enter one or more DAC channel aliases, or 'all' with a non-empty DAC directory.")
+        sys.exit(1)
+    return chanAddrs
+
+def read_runs(readMulti, chanAddrs): #Read each run of consecutive addresses in one request; returns {alias: value}
+    vals = {}
+    for startAddr, runChans in group_runs(chanAddrs):
+        vals.update(zip(runChans, readMulti(startAddr, len(runChans))))
+    return vals
+
+def write_out(text): #Write a command's whole output with one write(2) call, below the TextIOWrapper
+    if sys.stdout is not sys.__stdout__: #Redirected (e.g. captured by the socket daemon): write where it points
+        sys.stdout.write(text)
+        return
+    sys.stdout.flush() #Keep anything already print()ed ahead of this output
+    data = text.encode(sys.stdout.encoding, sys.stdout.errors)
+    while data: #Pipes may take less than the whole buffer at once
+        data = data[os.write(sys.stdout.fileno(), data):]
+
+def parse_dac_dir(path): #Return {alias: channel ID tuple} from a DAC directory file
+    import re
+    with open(path) as file:
+        data = file.read()
+    #Match each line's alias and the channel IDs before any comment
+    return {alias: tuple(map(int, ids.split()))
+            for alias, ids in re.findall(DAC_DIR_LINE, data, re.M)
+            if ids.strip()}
+
+def parse_temp_dir(path): #Return {alias: serial num} from a temperature sensor directory file
+    import re
+    with open(path) as file:
+        data = file.read()
+    #Strip every line's comment in one scan, skipping lines left blank
+    lines = [line.split() for line in re.findall(TEMP_DIR_LINE, data, re.M) if line]
+    return {entries[0]: int(entries[-1],0) for entries in lines}
+
+dir_file_cache = {} #{(parser, path, mtime): parsed dict}, so re-running init skips parsing unchanged directory files
+
+def load_dir_file(parse, path): #Parse a directory file, reusing the last parse while the file is unchanged
+    key = (parse, path, os.path.getmtime(path))
+    if key not in dir_file_cache:
+        dir_file_cache[key] = parse(path)
+    return dir_file_cache[key]
+
+def forward_command(argv): #Run a command in a socket daemon if one is listening; returns its exit status or None
+    if not os.path.exists(SOCKET_FILE): #Checked before importing anything, since usually no daemon is up
+        return None
+    import json, socket
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SOCKET_TIMEOUT)
+            sock.connect(SOCKET_FILE)
+            sock.sendall(json.dumps({'argv': argv}).encode())
+            sock.shutdown(socket.SHUT_WR) #End of request
+            reply = json.loads(b''.join(iter(lambda: sock.recv(4096), b'')).decode())
+    except (ConnectionError, FileNotFoundError): #Stale socket file: run the command in-process
+        return None
+    except socket.timeout:
+        print(f'Error: The DacManager daemon on {SOCKET_FILE} did not answer within {SOCKET_TIMEOUT} s.')
+        return 1
+    write_out(reply['out'])
+    return reply['status']
+
+
+### DEFINE COMMANDS
+# init command
+def init(args):
+    print('Settings:','\n\tSlave ID:\t ',args.slaveId,'\n\tPort #:\t\t ',args.port,
+          '\n\tBaudrate:\t ',args.baudrate,'\n\tNumber of Boards:',args.numBoards,
+          '\n\tAddress txt file:',args.addressFile,
+          '\n\tTemperature Serial Code txt file',args.tempFile)
     
-    # init command
-    def init(args):
-        print('Settings:','\n\tSlave ID:\t ',args.slaveId,'\n\tPort #:\t\t ',args.port,
-              '\n\tBaudrate:\t ',args.baudrate,'\n\tNumber of Boards:',args.numBoards,
-              '\n\tAddress txt file:',args.addressFile,
-              '\n\tTemperature Serial Code txt file',args.tempFile)
-        
-        addressDict = {} #Store the address directory here
-        with open(args.addressFile) as file:
-            for line in file:
-                line, _, comment = line.partition('#') #Filter out comments
-                if line.strip(): # If a non-blank line
-                    entries = []
-                    entries = tuple(line.split())
-                    addressDict[entries[0]] = tuple(int(i) for i in entries[1:])  #Add or update key-val pair
-                    #print("Entries:",entries[0])
-        
-        tempDict = {}
-        iv_tempDict = {}
-        with open(args.tempFile) as file:
-            for line in file:
-                line, _, comment = line.partition('#') #Filter out comments
-                if line.strip(): # If a non-blank line
-                    entries = []
-                    entries = tuple(line.split())
-                    tempDict[entries[0]] = int(entries[-1],0) #Dict to look up serial num from alias
-                    iv_tempDict[int(entries[-1],0)] = entries[0] #Inverse dictionary to look up alias from serial num
-                    
-        persisting_vars = (args.slaveId, args.port, args.baudrate, args.numBoards,
-                           TIMEOUT, addressDict, tempDict, iv_tempDict) #A tuple of vars to store in between commands
-        
-        var_file = open(varFileAbsDir, 'wb')
-        pickle.dump(persisting_vars,var_file) #Save persisting variables in obj file
-        
-        #Test connections
-        cntrl = dm(*persisting_vars[:-3])
-        addressDict = persisting_vars[-3]
-        tempDict = persisting_vars[-2]
-        iv_tempDict = persisting_vars[-1]
-        
-        print('Channel List:')
+    addressDict = load_dir_file(parse_dac_dir, args.addressFile)
+    tempDict = load_dir_file(parse_temp_dir, args.tempFile)
+    iv_tempDict = {serialNum: alias for alias,serialNum in tempDict.items()} #Inverse dict: serial num -> alias
+                
+    #Test connections
+    from DacMaster import DacMaster as dm
+    with dm(args.slaveId, args.port, args.baudrate, args.numBoards, TIMEOUT) as cntrl: #Closed even if a request fails
+        #Resolve each alias to its DAC channel address once here so later commands only do a dict lookup
+        resolvedDict = {key: cntrl.address(*chan) for key,chan in addressDict.items()}
+    
+        buf = ['Channel List:\n'] #Build the whole list, then write it at once
         for key,chan in addressDict.items():
+            buf.append(f'Alias: {key}\tChan #, DAC #, Board #: {chan}\t(DAC) Start Val: '
+                       f'{cntrl.convertToActualV(cntrl.readV(resolvedDict[key]))}V\n')
+        write_out(''.join(buf))
+    
+        numTemps = cntrl.initT()
+    
+        #Go through temp sensors on bus and make dict of serial num vs index
+        buf = [f'\nNumber of Temperature sensors on bus:  {numTemps}\n',
+               'Temperature Sensor Serial Numbers:\n']
+        tempIndexDict = {} #alias -> index on the bus, so readT can skip enumerating the sensors
+        for i, serialNum in enumerate(cntrl.getTSerialMulti(0, numTemps)): #index -> serial num
+            #Now see if there's an alias for this serial number
             try:
-                #print(*chan)
-                print('Alias: ',key,'\tChan #, DAC #, Board #: ',chan,'\t(DAC) Start Val: ',
-                      dm.convertToActualV(cntrl.readV(cntrl.address(*chan))),'V', sep='')
+                alias = iv_tempDict[int.from_bytes(serialNum,"big")]
+                tempIndexDict[alias] = i
+                buf.append(f"{alias}:\t0x{serialNum.hex()}\n")
             except KeyError:
-                print('Error: DAC channel address',key,'not found')
-                exit(1)
+                buf.append(f"No Alias Found:\t0x{serialNum.hex()}\n")
+        write_out(''.join(buf))
+    
+    persisting_vars = {'slaveId': args.slaveId, 'port': args.port, 'baudrate': args.baudrate,
+                       'numBoards': args.numBoards, 'timeout': TIMEOUT, 'addressDict': resolvedDict,
+                       'tempDict': tempDict, 'tempIndexDict': tempIndexDict} #Vars to store in between commands
+    
+    save_vars(varFileAbsDir, persisting_vars) #Save persisting variables in binary var file
+    vars_cache.clear()
+
+#Shared template for the per-channel commands: resolve the aliases, apply write (if any)
+#to each contiguous run of channels, then read back and print one line per channel
+def apply_to_chans(args, write, readName, lineFmt):
+    addressDict,_,_ = load_state()
+    chanAddrs = lookup_chans(addressDict, args.chan)
+    cntrl = get_cntrl()
+    try:
+        if write is not None:
+            for startAddr, runChans in group_runs(chanAddrs): #One modbus write per contiguous run
+                write(cntrl, startAddr, runChans)
+        vals = read_runs(getattr(cntrl, readName), chanAddrs)
+        write_out(''.join(lineFmt(cntrl, chan, vals[chan]) for chan,_ in chanAddrs))
+    finally:
+        close_command(cntrl)
+
+def pow_line(cntrl, chan, pow):
+    return f'(Ard) {chan} : \tPow = {bool(pow)}\n'
+
+#powerUp command
+def powUp(args):
+    apply_to_chans(args, lambda cntrl, startAddr, runChans: cntrl.powerUpMulti(startAddr, len(runChans)),
+                   'getPowerMulti', pow_line)
+
+#powerDown command
+def powDown(args):
+    apply_to_chans(args, lambda cntrl, startAddr, runChans: cntrl.powerDownMulti(startAddr, len(runChans)),
+                   'getPowerMulti', pow_line)
+
+#getPower command
+def getPower(args):
+    apply_to_chans(args, None, 'getPowerMulti', pow_line)
+
+def ard_v_line(cntrl, chan, rawV):
+    return f'(Ard) {chan} : \tV = {cntrl.convertToActualV(rawV)}\n'
+
+#getV command
+def getV(args):
+    apply_to_chans(args, None, 'getVMulti', ard_v_line)
+
+#getAllV command
+def getAllV(args):
+    args.chan = args.chan or ['all'] #Nothing entered means all the chans
+    apply_to_chans(args, None, 'getVMulti', ard_v_line)
+
+def dac_v_line(cntrl, chan, rawV):
+    return f'(DAC) {chan} : \tV =  {cntrl.convertToActualV(rawV)}\n'
+
+#readV command
+def readV(args):
+    apply_to_chans(args, None, 'readVMulti', dac_v_line)
+
+#updateV command
+def updateV(args):
+    apply_to_chans(args, lambda cntrl, startAddr, runChans:
+                       cntrl.updateVMulti(startAddr, [cntrl.convertToRawV(args.newV)]*len(runChans)),
+                   'readVMulti', dac_v_line)
+
+#updateVMulti command
+def updateVMulti(args):
+    addressDict,_,_ = load_state()
+    if(args.chan[0] in ALL_ALIASES): #One voltage per channel, so each channel must be named
+        print("Error: List each DAC channel alias; 'all' can't be paired with voltages.")
+        sys.exit(1)
+    if(len(args.newV) != len(args.chan)):
+        print('Error: Enter one -v voltage for each DAC channel.')
+        sys.exit(1)
+    chanAddrs = lookup_chans(addressDict, args.chan)
+    cntrl = get_cntrl()
+    try:
+        chanRawVs = dict(zip(args.chan, cntrl.convertToRawVArray(args.newV).tolist()))
+        for startAddr, runChans in group_runs(chanAddrs): #One modbus write per contiguous run
+            cntrl.updateVMulti(startAddr, [chanRawVs[chan] for chan in runChans])
+        rawVs = read_runs(cntrl.readVMulti, chanAddrs)
+        #NumPy is already loaded for convertToRawVArray, so convert the read-back voltages in one go too
+        volts = cntrl.convertToActualVArray([rawVs[chan] for chan in args.chan]).tolist()
+        write_out(''.join(f'(DAC) {chan} : \tV =  {v}\n' for chan, v in zip(args.chan, volts)))
+    finally:
+        close_command(cntrl)
+
+def find_temp_indices(cntrl, alias_to_serial): #Enumerate the sensors on the bus; returns {alias: index}
+    numTemps = cntrl.initT()
+    if(numTemps < 0):
+        raise RuntimeError(f'Error in initializing temperature sensors;\
+                           cntrl.initT() responded with: {numTemps}')
+    
+    #Make a dictionary to get serial num -> index
+    t_ser_dict = {}
+    for i, serialNum in enumerate(cntrl.getTSerialMulti(0, numTemps)): #index -> serial num
+        t_ser_dict[int.from_bytes(serialNum,"big")] = i #inverse dict: serial num -> index
         
+    alias_to_index = {}
+    for alias, serialNum in alias_to_serial.items():
+        try:
+            index = t_ser_dict[serialNum]
+            alias_to_index[alias] = index
+        except KeyError:
+            print(f"The temperature sensor with alias '{alias}' was not found "\
+                  +"on the data bus.")
+            sys.exit(1)
+    return alias_to_index
+
+def save_temp_indices(alias_to_index): #Store re-found sensor indices in the var file for the next readT
+    persisting_vars = dict(load_persisting_vars())
+    persisting_vars['tempIndexDict'] = {**persisting_vars['tempIndexDict'], **alias_to_index}
+    save_vars(varFileAbsDir, persisting_vars)
+    vars_cache.clear()
+
+def read_temps(cntrl, alias_to_index): #Record and read the sensors; returns (lowest index, raw temps from it)
+    #Record every sensor between the lowest and highest index in one request, then read them back
+    minIndex = min(alias_to_index.values())
+    maxIndex = max(alias_to_index.values())
+    cntrl.recordTMulti(minIndex, maxIndex - minIndex + 1)
+    #Wait for sensors to acquire temp values: poll the slave, up to the 12-bit conversion time
+    deadline = time.monotonic() + T_CONVERSION_TIME
+    while time.monotonic() < deadline and not cntrl.isTReady():
+        time.sleep(T_POLL_INTERVAL)
+    return minIndex, cntrl.getTMulti(minIndex, maxIndex - minIndex + 1)
+
+#readT command
+def readT(args):
+    _,tempDict,_ = load_state()
+    args.alias = expand_all(args.alias, tempDict) #If 'all' entered, use all aliased sensors
+    
+    #Check every alias against the directory before opening the serial port
+    alias_to_serial = {}
+    for alias in args.alias:
+        try:
+            alias_to_serial[alias] = tempDict[alias]
+        except KeyError:
+            print(f"The temperature sensor alias '{alias}' was not found in the "\
+                  +"temperature sensor directory")
+            sys.exit(1)
+    if not alias_to_serial: #Nothing entered, or 'all' with an empty temperature sensor directory
+        print("Error: Enter one or more temperature sensor aliases, or 'all' with a non-empty temperature sensor directory.")
+        sys.exit(1)
+    
+    #Use the sensor indices found by init unless asked to look for them on the bus again
+    tempIndexDict = load_persisting_vars()['tempIndexDict']
+    cached = not args.refresh and all(alias in tempIndexDict for alias in alias_to_serial)
+    
+    cntrl = get_cntrl()
+    try:
+        if cached:
+            alias_to_index = {alias: tempIndexDict[alias] for alias in alias_to_serial}
+            #Check the cached indices still hold the same sensors (e.g. not reordered by a reset)
+            minIndex = min(alias_to_index.values())
+            serials = cntrl.getTSerialMulti(minIndex, max(alias_to_index.values()) - minIndex + 1)
+            cached = all(int.from_bytes(serials[alias_to_index[alias] - minIndex],"big") == serialNum
+                         for alias, serialNum in alias_to_serial.items())
+        if cached:
+            minIndex, rawTemps = read_temps(cntrl, alias_to_index)
+        if not cached or any(rawTemps[i - minIndex] <= TEMP_DISCONNECTED_RAW for i in alias_to_index.values()):
+            #A sensor missing from its cached index (e.g. the Arduino was reset): enumerate the bus
+            alias_to_index = find_temp_indices(cntrl, alias_to_serial)
+            save_temp_indices(alias_to_index)
+            minIndex, rawTemps = read_temps(cntrl, alias_to_index)
+    
+        buf = []
+        for alias in args.alias:
+            rawTemp = rawTemps[alias_to_index[alias] - minIndex]
+            if(not args.Fahrenheit): #default
+                buf.append(f'{alias} : \tT =  {cntrl.convertToDegC(rawTemp)} C\n')
+            else:
+                buf.append(f'{alias} : \tT =  {cntrl.convertToDegC(rawTemp)*9/5 + 32} F\n')
+        write_out(''.join(buf))
+    finally:
+        close_command(cntrl)
+
+#numT command
+def numT(args):
+    cntrl,_,_,_ = init_command()
+    try:
         numTemps = cntrl.initT()
-        print('\nNumber of Temperature sensors on bus: ', numTemps)
-        
+        if(numTemps < 0):
+            raise RuntimeError(f'Error in initializing temperature sensors;\
+                               cntrl.initT() responded with: {numTemps}')
+        write_out(f'Number of temp sensors =  {numTemps}\n')
+    finally:
+        close_command(cntrl)
+
+#serT command
+def serT(args):
+    cntrl, addressDict,tempDict,iv_tempDict = init_command()
+    try:
         #Go through temp sensors on bus and make dict of serial num vs index
-        print("Temperature Sensor Serial Numbers:")
-        for i in range(numTemps):
-            serialNum = cntrl.getTSerial(i) #index -> serial num
+        numTemps = cntrl.initT()
+        if(numTemps < 0):
+            raise RuntimeError(f'Error in initializing temperature sensors;\
+                               cntrl.initT() responded with: {numTemps}')
+        buf = ['Temperature Sensor Serial Numbers:\n']
+        for serialNum in cntrl.getTSerialMulti(0, numTemps):
             #Now see if there's an alias for this serial number
             try:
                 alias = iv_tempDict[int.from_bytes(serialNum,"big")]
-                print(f"{alias}:\t0x{serialNum.hex()}")
+                buf.append(f"{alias}:\t0x{serialNum.hex()}\n")
             except KeyError:
-                print(f"No Alias Found:\t0x{serialNum.hex()}")
-                
-    
+                buf.append(f"No Alias Found:\t0x{serialNum.hex()}\n")
+                write_out(''.join(buf))
+                sys.exit(1)
+        write_out(''.join(buf))
+    finally:
+        close_command(cntrl)
+
+#daemon and repl commands
+def run_line(cmd_psr, argv): #Run one command line inside a session; returns its exit status
+    try:
+        cmd_args = fast_parse(argv) or cmd_psr.parse_args(argv)
+        if(not hasattr(cmd_args, 'func') or
+           cmd_args.func.__name__ in ('init','daemon','repl')):
+            print('Error: Enter a DAC or temperature command; init, daemon, and repl '
+                  'are not available here.')
+            return 1
+        cmd_args.func(cmd_args)
+    except SystemExit as err: #Bad arguments or a failed command shouldn't end the session
+        return err.code if isinstance(err.code, int) else 1
+    except Exception as err: #e.g. no response from the slave; keep the session going
+        print('Error:', err)
+        return 1
+    return 0
+
+def run_session(prompt): #Open the serial port once, then dispatch one command per input line
+    import shlex
+    global daemon_vars
+    daemon_vars = init_command()
+    cmd_psr = return_parser()
+    try:
+        while True:
+            try:
+                line = input(prompt)
+            except EOFError:
+                break
+            if line.strip().lower() in ('quit','exit'):
+                break
+            if not line.strip():
+                continue
+            run_line(cmd_psr, shlex.split(line))
+    finally:
+        cntrl = daemon_vars[0]
+        daemon_vars = None
+        cntrl.close()
+
+def serve_socket(path): #Open the serial port once, then run commands forwarded by forward_command()
+    import contextlib, io, json, socket, stat
+    global daemon_vars
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            print(f'Error: {path} exists and is not a socket; remove it or change SOCKET_FILE.')
+            sys.exit(1)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except ConnectionRefusedError:
+                os.remove(path) #Left over from a daemon that didn't exit cleanly
+            else:
+                print(f'Error: A DacManager daemon is already listening on {path}.')
+                sys.exit(1)
+    daemon_vars = init_command()
+    cmd_psr = return_parser()
+    bound = False #Only remove the socket file if this daemon made it
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(path)
+            bound = True
+            server.listen()
+            while True:
+                conn,_ = server.accept()
+                with conn:
+                    try:
+                        conn.settimeout(SOCKET_TIMEOUT) #A client that never finishes its request can't hold up the others
+                        data = b''.join(iter(lambda: conn.recv(4096), b''))
+                        if not data: #e.g. another daemon checking whether this one is alive
+                            continue
+                        request = json.loads(data.decode())
+                        out = io.StringIO()
+                        with contextlib.redirect_stdout(out):
+                            status = run_line(cmd_psr, request['argv'])
+                        conn.sendall(json.dumps({'out': out.getvalue(), 'status': status}).encode())
+                    except (OSError, ValueError, KeyError, TypeError) as err: #A bad or dropped request; keep serving
+                        print('Error in forwarded command:', err)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if bound:
+            os.remove(path)
+        cntrl = daemon_vars[0]
+        daemon_vars = None
+        cntrl.close()
+
+def daemon(args):
+    if args.socket:
+        print(f"DacManager daemon listening on {SOCKET_FILE}. Ctrl-C to exit.")
+        serve_socket(SOCKET_FILE)
+    else:
+        print("DacManager daemon ready. Enter one command per line; 'quit' or EOF to exit.")
+        run_session('')
+
+def repl(args):
+    try:
+        import readline #Line editing and history for input(), where the platform has it
+    except ImportError:
+        pass
+    print("Enter DacManager commands without 'python cmdUI.py'; 'quit' or Ctrl-D to exit.")
+    run_session('dac> ')
+
+
+### FAST DISPATCH
+#Commands whose arguments are only DAC channel aliases (after a voltage, for updateV) can skip
+# building the argparse parser; anything with an option (e.g. -h) still goes through argparse.
+FAST_CMDS = {'powerUp': powUp, 'powUp': powUp, 'powerDown': powDown, 'powDn': powDown,
+             'powDown': powDown, 'getPower': getPower, 'getPow': getPower, 'getP': getPower,
+             'getV': getV, 'getAllV': getAllV, 'readV': readV, 'rdV': readV,
+             'updateV': updateV, 'newV': updateV}
+
+def fast_parse(argv): #Return the args for a FAST_CMDS command line, or None if argparse is needed
+    if not argv or argv[0] not in FAST_CMDS or any(arg.startswith('-') for arg in argv[1:]):
+        return None
+    func = FAST_CMDS[argv[0]]
+    if func is updateV:
+        try:
+            return argparse.Namespace(func=func, newV=float(argv[1]), chan=argv[2:])
+        except (IndexError, ValueError): #Let argparse report the bad or missing voltage
+            return None
+    return argparse.Namespace(func=func, chan=argv[1:])
+
+### DEFINE COMMAND LINE PARSERS
+#Each subcommand's parser is built by its own function, so a command line only has to build the
+# one it names. Unknown commands and top-level options (e.g. -h) build all of them.
+def add_init_parser(subpsrs):
     psr_init = subpsrs.add_parser('init', #aliases=['in']
                                         help='Initialize DAC communications. Read the DAC and temperature sensor '
                                         +'directory files. This must be called whenever one of those files is '
@@ -159,153 +638,52 @@ def return_parser():
                               +'to specify the temperature controller mapping. Make sure there are fewer '
                               +'temperature sensors on the bus then the variable NUM_TEMPS in the Arduino code.')
     psr_init.set_defaults(func=init)
-    
-    #powerUp command
-    def powUp(args):            
-        cntrl, addressDict,_,_ = init_command()
-        if(args.chan[0].lower()) == 'all': #If 'all' entered, use all the chans
-            args.chan = list(addressDict.keys())
-        for chan in args.chan:
-            try:
-                channel = cntrl.address(*addressDict[chan])
-                #print(*addressDict[chan])
-                #print(channel)
-                #print(addressDict)
-                cntrl.powerUp(channel)
-                print('(Ard)', chan,': \tPow =',bool(cntrl.getPower(channel)))
-            except KeyError:
-                print('Error: DAC channel address for',chan,'not found. See ' +
-                      'DacDir.txt or the DAC directory file you specified for ' +
-                      'a list of available DAC names.')
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-            
-    
+
+def add_powUp_parser(subpsrs):
     psr_powUp = subpsrs.add_parser('powerUp', aliases=['powUp'],
                                         help='Power up a channel')
     psr_powUp.add_argument('chan', type=str, nargs='*',
                               help="Aliases of DAC channels separated by a space or 'all'.")
     psr_powUp.set_defaults(func=powUp)
-    
-    #powerDown command
-    def powDown(args):
-        cntrl, addressDict,_,_ = init_command()
-        if(args.chan[0].lower()) == 'all': #If 'all' entered, use all the chans
-            args.chan = list(addressDict.keys())
-        for chan in args.chan:
-            try:
-                channel = cntrl.address(*addressDict[chan])
-                #print(channel)
-                cntrl.powerDown(channel)
-                print('(Ard)', chan,': \tPow =',bool(cntrl.getPower(channel)))
-            except KeyError:
-                print('Error: DAC channel address for',chan,'not found. See ' +
-                      'DacDir.txt or the DAC directory file you specified for ' +
-                      'a list of available DAC names.')
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-            
+
+def add_powDown_parser(subpsrs):
     psr_powDown = subpsrs.add_parser('powerDown', aliases=['powDn','powDown'],
                                       help='Power down a channel.')
     psr_powDown.add_argument('chan', type=str, nargs='*',
                               help="Aliases of DAC channels separated by a space or 'all'.")
     psr_powDown.set_defaults(func=powDown)
-    
-    #getPower command
-    def getPower(args):
-        cntrl, addressDict,_,_ = init_command()
-        if(args.chan[0].lower()) == 'all': #If 'all' entered, use all the chans
-            args.chan = list(addressDict.keys())
-        for chan in args.chan:
-            try:
-                channel = cntrl.address(*addressDict[chan])
-                #print(channel)
-                print('(Ard)', chan,': \tPow =',bool(cntrl.getPower(channel)))
-            except KeyError:
-                print('Error: DAC channel address for',chan,'not found. See ' +
-                      'DacDir.txt or the DAC directory file you specified for ' +
-                      'a list of available DAC names.')
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-            
+
+def add_getPow_parser(subpsrs):
     psr_getPow= subpsrs.add_parser('getPower', aliases=['getPow','getP'],
                                       help='Return whether or not a channel is powered on, '
                                       'according to the last stored value in the Arduino.')
     psr_getPow.add_argument('chan', type=str, nargs='*',
                               help="Aliases of DAC channels separated by a space or 'all'.")
     psr_getPow.set_defaults(func=getPower)
-    
-    #getV command
-    def getV(args):
-        cntrl, addressDict,_,_ = init_command()
-        if(args.chan[0].lower()) == 'all': #If 'all' entered, use all the chans
-            args.chan = list(addressDict.keys())
-        for chan in args.chan:
-            try:
-                channel = cntrl.address(*addressDict[chan])
-                #print(channel)
-                print('(Ard)', chan,': \tV =',dm.convertToActualV(cntrl.getV(channel)))
-            except KeyError:
-                print('Error: DAC channel address for',chan,'not found. See ' +
-                      'DacDir.txt or the DAC directory file you specified for ' +
-                      'a list of available DAC names.')
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-    
+
+def add_getV_parser(subpsrs):
     psr_getV = subpsrs.add_parser('getV',
                                    help='Returns the last commanded voltage stored on the Arduino')
     psr_getV.add_argument('chan', type=str, nargs='*',
                            help="Aliases of DAC channels separated by a space or 'all'.")
     psr_getV.set_defaults(func=getV)
-    
-    #readV command
-    def readV(args):
-        cntrl, addressDict,_,_ = init_command()
-        if(args.chan[0].lower()) == 'all': #If 'all' entered, use all the chans
-            args.chan = list(addressDict.keys())
-        for chan in args.chan:
-            try:
-                channel = cntrl.address(*addressDict[chan])
-                #print(channel)
-                print('(DAC)', chan,': \tV = ',dm.convertToActualV(cntrl.readV(channel)))
-            except KeyError:
-                print('Error: DAC channel address for',chan,'not found. See ' +
-                      'DacDir.txt or the DAC directory file you specified for ' +
-                      'a list of available DAC names.')
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-    
+
+def add_getAllV_parser(subpsrs):
+    psr_getAllV = subpsrs.add_parser('getAllV',
+                                      help='Returns the last commanded voltages stored on the Arduino, '
+                                      'reading contiguous channels together in one request.')
+    psr_getAllV.add_argument('chan', type=str, nargs='*',
+                              help="Aliases of DAC channels separated by a space or 'all' (the default).")
+    psr_getAllV.set_defaults(func=getAllV)
+
+def add_readV_parser(subpsrs):
     psr_readV = subpsrs.add_parser('readV', aliases=['rdV'],
                                    help='Queries the DAC for actual voltage')
     psr_readV.add_argument('chan', type=str, nargs='*',
                            help="Aliases of DAC channels separated by a space or 'all'.")
     psr_readV.set_defaults(func=readV)
-    
-    
-    #updateV command
-    def updateV(args):
-        cntrl, addressDict,_,_ = init_command()
-        if(args.chan[0].lower()) == 'all': #If 'all' entered, use all the chans
-            args.chan = list(addressDict.keys())
-        for chan in args.chan:
-            try:
-                channel = cntrl.address(*addressDict[chan])
-                #print(channel, args.newV)
-                cntrl.updateV(channel, cntrl.convertToRawV(args.newV))
-                print('(DAC)', chan,': \tV = ',dm.convertToActualV(cntrl.readV(channel)))
-            except KeyError:
-                print('Error: DAC channel address for',chan,'not found. See ' +
-                      'DacDir.txt or the DAC directory file you specified for ' +
-                      'a list of available DAC names.')
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-    
+
+def add_updateV_parser(subpsrs):
     psr_updateV = subpsrs.add_parser('updateV', aliases=['newV'],
                                      help='Updates the voltage on the DAC channel')
     psr_updateV.add_argument('newV',type=float,
@@ -313,121 +691,104 @@ def return_parser():
     psr_updateV.add_argument('chan', type=str, nargs='*',
                               help="Aliases of DAC channels separated by a space or 'all'.")
     psr_updateV.set_defaults(func=updateV)
-    
-    
-    #readT command
-    def readT(args):
-        cntrl, addressDict,tempDict,iv_tempDict = init_command()
-        numTemps = cntrl.initT()
-        if(numTemps < 0):
-            raise RuntimeError(f'Error in initializing temperature sensors;\
-                               cntrl.initT() responded with: {numTemps}')
-            cntrl.close(); exit(1)
-        
-        #Make a dictionary to get serial num -> index
-        t_ser_dict = {}
-        for i in range(numTemps):
-            serialNum = cntrl.getTSerial(i) #index -> serial num
-            t_ser_dict[int.from_bytes(serialNum,"big")] = i #inverse dict: serial num -> index
-            
-        if(args.alias[0].lower()) == 'all': #If 'all' entered, use all sensors on the bus
-            args.alias = list(tempDict.keys())
-            
-        alias_to_index = {}
-        for alias in args.alias:
-            try:
-                serialNum = tempDict[alias]
-            except KeyError:
-                print(f"The temperature sensor alias '{alias}' was not found in the "\
-                      +"temperature sensor directory")
-                cntrl.close()
-                exit(1)
-            try:
-                index = t_ser_dict[serialNum]
-                alias_to_index[alias] = index
-            except KeyError:
-                print(f"The temperature sensor with alias '{alias}' was not found "\
-                      +"on the data bus.")
-                cntrl.close()
-                exit(1)
-        
-        for alias in args.alias:
-            index = alias_to_index[alias]
-            cntrl.recordT(index)
-        time.sleep(0.75) #Wait for sensors to acquire temp values
-        for alias in args.alias:
-            index = alias_to_index[alias]
-            if(not args.Fahrenheit): #default
-                print(alias,': \tT = ', dm.convertToDegC(cntrl.getT(index)), 'C')
-            else:
-                print(alias,': \tT = ', 
-                      dm.convertToDegC(cntrl.getT(index))*9/5 + 32, 'F')
-                
-        cntrl.close()
-    
+
+def add_updateVMulti_parser(subpsrs):
+    psr_updateVMulti = subpsrs.add_parser('updateVMulti', aliases=['newVs'],
+                                          help='Updates each DAC channel to its own voltage. Requires NumPy.')
+    psr_updateVMulti.add_argument('-v','--newV', type=float, action='append', required=True,
+                                  help="A new voltage to output. Give -v once per channel, in the same order as the channels.")
+    psr_updateVMulti.add_argument('chan', type=str, nargs='+',
+                                  help="Aliases of DAC channels separated by a space.")
+    psr_updateVMulti.set_defaults(func=updateVMulti)
+
+def add_readT_parser(subpsrs):
     psr_readT = subpsrs.add_parser('readT', aliases=['rdT'],
                                     help='Returns the temperature, in degrees Celsius, on the sensor.')
     psr_readT.add_argument('-F','--Fahrenheit', action='store_true',
                              help='Output in Fahrenheit instead of Celsius.')
+    psr_readT.add_argument('-r','--refresh', action='store_true',
+                             help='Find the sensors on the data bus again instead of using the indices '
+                             +'found by init, e.g. after changing which sensors are connected.')
     psr_readT.add_argument('alias', type=str, nargs='*',
                             help="Aliases of temperature sensors on data bus or 'all'.")
     psr_readT.set_defaults(func=readT)
-    
-    
-    #numT command
-    def numT(args):
-        cntrl,_,_,_ = init_command()
-        numTemps = cntrl.initT()
-        if(numTemps < 0):
-            raise RuntimeError(f'Error in initializing temperature sensors;\
-                               cntrl.initT() responded with: {numTemps}')
-            cntrl.close(); exit(1)
-        print('Number of temp sensors = ',numTemps)            
-        cntrl.close()
-    
+
+def add_numT_parser(subpsrs):
     psr_numT = subpsrs.add_parser('numTempSensors', aliases=['numT'],
                                   help="Returns the total number of temperature \
                                         sensors detected on the data bus. '-1' \
                                         denotes an error.")
     psr_numT.set_defaults(func=numT)
-    
-    
-    #serT command
-    def serT(args):
-        cntrl, addressDict,tempDict,iv_tempDict = init_command()
-        #Go through temp sensors on bus and make dict of serial num vs index
-        numTemps = cntrl.initT()
-        if(numTemps < 0):
-            raise RuntimeError(f'Error in initializing temperature sensors;\
-                               cntrl.initT() responded with: {numTemps}')
-            cntrl.close(); exit(1)
-        print("Temperature Sensor Serial Numbers:")
-        for i in range(numTemps):
-            serialNum = cntrl.getTSerial(i) #index -> serial num
-            #Now see if there's an alias for this serial number
-            try:
-                alias = iv_tempDict[int.from_bytes(serialNum,"big")]
-                print(f"{alias}:\t0x{serialNum.hex()}")
-            except KeyError:
-                print(f"No Alias Found:\t0x{serialNum.hex()}")
-                cntrl.close()
-                exit(1)
-        cntrl.close()
-        
+
+def add_serT_parser(subpsrs):
     psr_serT = subpsrs.add_parser('tempSensorSerNums', aliases=['serT'],
                                   help="Returns the serial numbers for all temp "+
                                   "sensors detected on the data bus, as long as there "+
                                   "are fewer sensors than the value of the variable "+
                                   "NUM_TEMPS in the Arduino code.")
     psr_serT.set_defaults(func=serT)
-    
+
+def add_daemon_parser(subpsrs):
+    psr_daemon = subpsrs.add_parser('daemon',
+                                    help='Keep the serial port open and read commands (e.g. '
+                                    +"'updateV 5 chan1') from stdin, one per line, until 'quit' or EOF.")
+    psr_daemon.add_argument('--socket', action='store_true',
+                            help=f'Instead of reading stdin, listen on the Unix socket {SOCKET_FILE}. '
+                            +'Other cmdUI.py invocations then forward their commands to this daemon. '
+                            +'Restart the daemon after running init.')
+    psr_daemon.set_defaults(func=daemon)
+
+def add_repl_parser(subpsrs):
+    psr_repl = subpsrs.add_parser('repl',
+                                  help='Start an interactive prompt that runs commands (e.g. '
+                                  +"'updateV 5 chan1') over one open serial port.")
+    psr_repl.set_defaults(func=repl)
+
+PARSER_BUILDERS = (
+    (('init',), add_init_parser),
+    (('powerUp', 'powUp'), add_powUp_parser),
+    (('powerDown', 'powDn', 'powDown'), add_powDown_parser),
+    (('getPower', 'getPow', 'getP'), add_getPow_parser),
+    (('getV',), add_getV_parser),
+    (('getAllV',), add_getAllV_parser),
+    (('readV', 'rdV'), add_readV_parser),
+    (('updateV', 'newV'), add_updateV_parser),
+    (('updateVMulti', 'newVs'), add_updateVMulti_parser),
+    (('readT', 'rdT'), add_readT_parser),
+    (('numTempSensors', 'numT'), add_numT_parser),
+    (('tempSensorSerNums', 'serT'), add_serT_parser),
+    (('daemon',), add_daemon_parser),
+    (('repl',), add_repl_parser),
+)
+
+parser_cache = {} #{builders used: parser}, so a parser is only built once per process
+
+def return_parser(command=None):
+    builders = tuple(builder for names, builder in PARSER_BUILDERS if command in names)
+    builders = builders or tuple(builder for names, builder in PARSER_BUILDERS)
+    if builders in parser_cache:
+        return parser_cache[builders]
+    psr = argparse.ArgumentParser(description='Control Voltages on the DACs ' +
+                                  'and read temperature sensors with this ' +
+                                  'interface. Make sure cmdUI.py is on your ' +
+                                  'PythonPath before use.')
+    subpsrs = psr.add_subparsers()
+    for builder in builders:
+        builder(subpsrs)
+    parser_cache[builders] = psr
     return psr
 
 def main():
     ### PARSE COMMAND LINE AND EVALUATE
-    args = return_parser().parse_args() #Parse the args
+    args = fast_parse(sys.argv[1:]) #Skip building the parser for plain channel commands
+    if args is None:
+        args = return_parser(sys.argv[1] if len(sys.argv) > 1 else None).parse_args() #Parse the args
     
     if(bool(vars(args))): #Check if command argument supplied
+        if(args.func.__name__ not in ('init','daemon','repl')): #Let a socket daemon run it if one is up
+            status = forward_command(sys.argv[1:])
+            if status is not None:
+                sys.exit(status)
         args.func(args)         #Call whatever function was selected
     else:
         raise ValueError('A valid command or option is required to run this script. ' +